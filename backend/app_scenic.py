@@ -1,8 +1,11 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import TypedDict, Dict, List, Tuple
+from typing import TypedDict, Dict, List, Tuple, Optional, Annotated, AsyncIterator
 from langgraph.graph import StateGraph
-import os, math, time, requests
+from langgraph.types import Send
+import os, math, time, asyncio, hashlib, httpx, orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,28 +14,54 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # --------- STATE ---------
+def merge_places(left: Dict[str, List[Dict]], right: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+    # Reducer so each per-route PlacesAgent branch can contribute its own entry.
+    return {**(left or {}), **(right or {})}
+
 class TripState(TypedDict, total=False):
     origin: str
     destination: str
     routes: List[Dict]
-    places_by_route: Dict[str, List[Dict]]
+    places_by_route: Annotated[Dict[str, List[Dict]], merge_places]
     scenic_scores: Dict[str, float]
     explanation: str
+    top_route_id: str
 
-# --------- SAFE REQUEST HELPERS ---------
-def safe_post(url: str, headers: Dict, json: Dict) -> Dict:
-    try:
-        r = requests.post(url, headers=headers, json=json, timeout=15)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
-        return {}
+class PlacesTask(TypedDict):
+    origin: str
+    destination: str
+    route: Dict
+
+# --------- RESPONSE CACHES ---------
+# Repeated origin/destination pairs are answered from memory for an hour.
+_routes_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+_places_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+# Explanations are keyed on a digest of the full prompt and kept for a day.
+_explain_cache: TTLCache = TTLCache(maxsize=1024, ttl=86400)
+
+def prompt_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
 
-def safe_get(url: str, params: Dict) -> Dict:
+# --------- HTTP CLIENT ---------
+# Shared async client, opened on FastAPI startup and closed on shutdown.
+client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=15,
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return client
+
+# --------- SAFE REQUEST HELPERS ---------
+async def safe_post(url: str, headers: Dict, json: Dict) -> Dict:
     try:
-        r = requests.get(url, params=params, timeout=15)
+        r = await get_client().post(url, headers=headers, json=json)
         r.raise_for_status()
-        return r.json()
+        return orjson.loads(r.content)
     except Exception:
         return {}
 
@@ -64,19 +93,33 @@ def mock_places() -> List[Dict]:
     ]
 
 # --------- ROUTE AGENT ---------
-def get_routes(state: TripState) -> TripState:
+def label_routes(routes: List[Dict]) -> List[Dict]:
+    # The Routes API has no id/label; derive them from routeLabels.
+    for idx, r in enumerate(routes):
+        if "DEFAULT_ROUTE" in r.get("routeLabels", []):
+            r.setdefault("id", "fastest")
+            r.setdefault("label", "Fastest")
+        else:
+            r.setdefault("id", f"alt{idx}")
+            r.setdefault("label", f"Alternative {idx}")
+    return routes
+
+async def get_routes(state: TripState) -> TripState:
     if not GOOGLE_API_KEY:
         state["routes"] = mock_routes(state["origin"], state["destination"])
         return state
-    
+
+    key = (state["origin"], state["destination"])
+    if key in _routes_cache:
+        state["routes"] = _routes_cache[key]
+        return state
+
     url = "https://routes.googleapis.com/directions/v2:computeRoutes"
     headers = {
         "Content-Type": "application/json",
         "X-Goog-Api-Key": GOOGLE_API_KEY,
-        "X-Goog-FieldMask": (
-            "routes.distanceMeters,routes.duration,routes.polyline.encodedPolyline,"
-            "routes.description,routes.routeLabels"
-        ),
+        # Only the fields read downstream: geometry for the map, labels for id/label.
+        "X-Goog-FieldMask": "routes.polyline.encodedPolyline,routes.routeLabels",
     }
     body = {
         "origin": {"address": state["origin"]},
@@ -84,113 +127,327 @@ def get_routes(state: TripState) -> TripState:
         "computeAlternativeRoutes": True,
         "travelMode": "DRIVE",
     }
-    resp = safe_post(url, headers, body)
-    state["routes"] = resp.get("routes", []) or mock_routes(state["origin"], state["destination"])
+    resp = await safe_post(url, headers, body)
+    routes = label_routes(resp.get("routes", []))
+    if routes:
+        _routes_cache[key] = routes
+    state["routes"] = routes or mock_routes(state["origin"], state["destination"])
     return state
 
 # --------- PLACES AGENT ---------
-def get_places(state: TripState) -> TripState:
-    places_by_route = {}
-    for r in state.get("routes", []):
-        if not GOOGLE_API_KEY:
-            places_by_route[r["id"]] = mock_places()
-        else:
-            params = {
-                "location": "34.8697,-111.7609",
-                "radius": 4000,
-                "type": "park",
-                "key": GOOGLE_API_KEY,
-            }
-            data = safe_get("https://maps.googleapis.com/maps/api/place/nearbysearch/json", params)
-            places_by_route[r["id"]] = data.get("results", [])
-    state["places_by_route"] = places_by_route
-    return state
+async def _fetch_one(task: PlacesTask) -> List[Dict]:
+    if not GOOGLE_API_KEY:
+        return mock_places()
+    route = task["route"]
+    key = (task["origin"], task["destination"], route.get("polyline", {}).get("encodedPolyline", ""))
+    if key in _places_cache:
+        return _places_cache[key]
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": GOOGLE_API_KEY,
+        # scenic_score reads types/rating; displayName feeds the highlights.
+        "X-Goog-FieldMask": "places.types,places.rating,places.displayName",
+    }
+    body = {
+        "includedTypes": ["park"],
+        "locationRestriction": {
+            "circle": {"center": {"latitude": 34.8697, "longitude": -111.7609}, "radius": 4000.0},
+        },
+    }
+    data = await safe_post("https://places.googleapis.com/v1/places:searchNearby", headers, body)
+    places = [
+        {
+            "name": p.get("displayName", {}).get("text", ""),
+            "types": p.get("types", []),
+            "rating": p.get("rating", 0),
+        }
+        for p in data.get("places", [])
+    ]
+    if places:
+        _places_cache[key] = places
+    return places
+
+async def get_places(task: PlacesTask) -> TripState:
+    # Runs once per route; LangGraph executes the branches concurrently.
+    try:
+        places = await _fetch_one(task)
+    except Exception:
+        places = []
+    return {"places_by_route": {task["route"]["id"]: places}}
+
+def fan_out_places(state: TripState):
+    routes = state.get("routes", [])
+    if not routes:
+        return "ScenicAgent"
+    return [
+        Send("PlacesAgent", {"origin": state["origin"], "destination": state["destination"], "route": r})
+        for r in routes
+    ]
 
 # --------- SCENIC AGENT ---------
+SCENIC_TYPES = frozenset({"park", "natural_feature", "tourist_attraction"})
+
 def scenic_score(state: TripState) -> TripState:
     scores = {}
+    best_id, best_score = None, -1.0
     for r in state.get("routes", []):
         places = state.get("places_by_route", {}).get(r["id"], [])
-        parks = sum(1 for p in places if "park" in p.get("types", []))
-        water = sum(1 for p in places if "natural_feature" in p.get("types", []))
-        attractions = sum(1 for p in places if "tourist_attraction" in p.get("types", []))
-        avg_rating = sum(p.get("rating", 0) for p in places) / max(1, len(places))
+        parks = water = attractions = rating_sum = n = 0
+        for p in places:
+            hits = SCENIC_TYPES.intersection(p.get("types") or ())
+            if hits:
+                parks += "park" in hits
+                water += "natural_feature" in hits
+                attractions += "tourist_attraction" in hits
+            rating_sum += p.get("rating", 0)
+            n += 1
+        avg_rating = rating_sum / n if n else 0.0
         score = 0.4*parks + 0.3*water + 0.2*attractions + 0.5*avg_rating
-        scores[r["id"]] = round(min(10.0, score), 2)
+        score = round(min(10.0, score), 2)
+        scores[r["id"]] = score
+        # Strict > keeps the first route on ties, as max() did.
+        if score > best_score:
+            best_id, best_score = r["id"], score
     state["scenic_scores"] = scores
+    state["top_route_id"] = best_id
     return state
 
 # --------- EXPLAIN AGENT (LLM) ---------
-def explain_with_gemini(state: TripState) -> TripState:
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash"
+MAX_HIGHLIGHTS_CHARS = 80
+# A 2-3 sentence blurb fits well inside 120 tokens; stop at the first blank line.
+GENERATION_CONFIG = {
+    "maxOutputTokens": 120,
+    "temperature": 0.4,
+    "topP": 0.9,
+    "stopSequences": ["\n\n"],
+}
+
+def join_highlights(names: List[str], limit: int = MAX_HIGHLIGHTS_CHARS) -> str:
+    """Join names with ", " while the result stays within `limit` characters.
+
+    The first name is always kept; if it alone is too long it is cut on a word boundary.
+    """
+    if not names:
+        return ""
+    first = names[0]
+    if len(first) > limit:
+        cut = first[:limit]
+        if first[limit] != " " and " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+        return cut.rstrip()
+    highlights = first
+    for name in names[1:]:
+        if len(highlights) + 2 + len(name) > limit:
+            break
+        highlights = f"{highlights}, {name}"
+    return highlights
+
+def candidate_text(data: Dict) -> str:
+    return data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+def explain_prompt(state: TripState) -> Optional[Tuple[str, str]]:
+    """Return (prompt, fallback text) for the top route, or None without routes."""
     routes = state.get("routes", [])
     scenic_scores = state.get("scenic_scores", {})
     places_by_route = state.get("places_by_route", {})
 
-    if not routes:
-        state["explanation"] = "No routes available."
-        return state
-    
-    top = max(routes, key=lambda r: scenic_scores.get(r["id"], 0))
-    highlights = ", ".join(p.get("name", "") for p in places_by_route.get(top["id"], [])[:3]) or "parks and landmarks"
+    top_id = state.get("top_route_id")
+    top = next((r for r in routes if r["id"] == top_id), None)
+    if top is None:
+        return None
+
+    names = [p.get("name", "") for p in places_by_route.get(top["id"], [])[:3]]
+    highlights = join_highlights([n for n in names if n]) or "parks and landmarks"
     score = scenic_scores.get(top["id"], 0)
 
-    prompt = f"""You are Tripster, a travel guide.
-The route '{top.get('label','Scenic')}' scores {score}/10.
-It passes highlights like {highlights}.
-Explain in 2–3 friendly sentences why this route is scenic."""
+    prompt = (
+        f"You are Tripster, a travel guide. Route '{top.get('label','Scenic')}' scores {score}/10 "
+        f"and passes {highlights}. In 2-3 friendly sentences, say why it is scenic."
+    )
+    return prompt, f"This route scores {score}/10 with highlights: {highlights}."
+
+async def generate_explanation(prompt: str) -> str:
+    headers = {"Content-Type": "application/json"}
+    payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": GENERATION_CONFIG}
+    resp = await get_client().post(f"{GEMINI_URL}:generateContent?key={GEMINI_API_KEY}", headers=headers, json=payload)
+    resp.raise_for_status()
+    return candidate_text(orjson.loads(resp.content))
+
+# --------- EXPLAIN SINGLE-FLIGHT ---------
+# Concurrent requests for the same prompt share one in-flight Gemini call.
+# Distinct prompts go straight out: generateContent reads several `contents`
+# as one conversation, so there is nothing to gain by holding calls back.
+_inflight_explains: Dict[bytes, asyncio.Future] = {}
+
+async def submit_explain(prompt: str) -> str:
+    key = prompt_key(prompt)
+    fut = _inflight_explains.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(generate_explanation(prompt))
+        _inflight_explains[key] = fut
+
+        def _done(f: asyncio.Future) -> None:
+            _inflight_explains.pop(key, None)
+            # Retrieve the error even if every waiter was cancelled, so asyncio
+            # does not log "Task exception was never retrieved".
+            if not f.cancelled():
+                f.exception()
+
+        fut.add_done_callback(_done)
+    # shield: one caller being cancelled must not cancel the call for the others
+    return await asyncio.shield(fut)
+
+async def explain_with_gemini(state: TripState) -> TripState:
+    prepared = explain_prompt(state)
+    if prepared is None:
+        state["explanation"] = "No routes available."
+        return state
+    prompt, fallback = prepared
 
     if not GEMINI_API_KEY:
-        state["explanation"] = f"This route scores {score}/10 with highlights: {highlights}."
+        state["explanation"] = fallback
+        return state
+
+    key = prompt_key(prompt)
+    if key in _explain_cache:
+        state["explanation"] = _explain_cache[key]
         return state
 
     try:
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro:generateContent"
-        headers = {"Content-Type": "application/json"}
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        resp = requests.post(f"{url}?key={GEMINI_API_KEY}", headers=headers, json=payload, timeout=15)
-        data = resp.json()
-        state["explanation"] = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+        state["explanation"] = await submit_explain(prompt)
+        if state["explanation"]:
+            _explain_cache[key] = state["explanation"]
     except Exception:
-        state["explanation"] = f"This route scores {score}/10 with highlights: {highlights}."
+        state["explanation"] = fallback
     return state
 
+async def stream_explanation(prepared: Optional[Tuple[str, str]]) -> AsyncIterator[str]:
+    """Yield explanation text for an explain_prompt() result as Gemini produces it (SSE).
+
+    If the stream fails after some text was yielded, the error is re-raised so
+    the caller can flag the answer as cut off; before any text, the fallback is yielded.
+    """
+    if prepared is None:
+        yield "No routes available."
+        return
+    prompt, fallback = prepared
+
+    if not GEMINI_API_KEY:
+        yield fallback
+        return
+
+    key = prompt_key(prompt)
+    if key in _explain_cache:
+        yield _explain_cache[key]
+        return
+
+    parts: List[str] = []
+    try:
+        headers = {"Content-Type": "application/json"}
+        payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": GENERATION_CONFIG}
+        url = f"{GEMINI_URL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+        async with get_client().stream("POST", url, headers=headers, json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                text = candidate_text(orjson.loads(line[5:]))
+                if text:
+                    parts.append(text)
+                    yield text
+        # Only a stream that ran to the end is a complete answer worth caching.
+        if parts:
+            _explain_cache[key] = "".join(parts)
+    except Exception:
+        # Mid-stream failure: nothing is cached, and sent text is incomplete.
+        if parts:
+            raise
+    if not parts:
+        yield fallback
+
 # --------- LANGGRAPH ---------
-graph = StateGraph(TripState)
-graph.add_node("RouteAgent", get_routes)
-graph.add_node("PlacesAgent", get_places)
-graph.add_node("ScenicAgent", scenic_score)
-graph.add_node("ExplainAgent", explain_with_gemini)
-graph.add_edge("RouteAgent", "PlacesAgent")
-graph.add_edge("PlacesAgent", "ScenicAgent")
-graph.add_edge("ScenicAgent", "ExplainAgent")
-graph.set_entry_point("RouteAgent")
-graph.set_finish_point("ExplainAgent")
-app_graph = graph.compile()
+def build_graph(explain: bool = True):
+    graph = StateGraph(TripState)
+    graph.add_node("RouteAgent", get_routes)
+    graph.add_node("PlacesAgent", get_places)
+    graph.add_node("ScenicAgent", scenic_score)
+    graph.add_conditional_edges("RouteAgent", fan_out_places, ["PlacesAgent", "ScenicAgent"])
+    graph.add_edge("PlacesAgent", "ScenicAgent")
+    graph.set_entry_point("RouteAgent")
+    if explain:
+        graph.add_node("ExplainAgent", explain_with_gemini)
+        graph.add_edge("ScenicAgent", "ExplainAgent")
+        graph.set_finish_point("ExplainAgent")
+    else:
+        graph.set_finish_point("ScenicAgent")
+    return graph.compile()
+
+app_graph = build_graph()
+# Same pipeline without ExplainAgent; /scenic/stream streams the explanation itself.
+scout_graph = build_graph(explain=False)
 
 # --------- FASTAPI ---------
 class ScenicRequest(BaseModel):
     origin: str
     destination: str
+    includePois: bool = False
 
-app = FastAPI(title="Tripster Scenic API")
+app = FastAPI(title="Tripster Scenic API", default_response_class=ORJSONResponse)
 
-@app.post("/scenic")
-def scenic_trip(req: ScenicRequest):
-    result = app_graph.invoke({"origin": req.origin, "destination": req.destination})
+@app.on_event("startup")
+async def open_client():
+    get_client()
+
+@app.on_event("shutdown")
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+def scenic_response(result: TripState, include_pois: bool = False) -> Dict:
+    scores = result.get("scenic_scores", {})
     routes = [
         {
             "id": r["id"],
             "label": r.get("label", "Route"),
             "polyline": r["polyline"]["encodedPolyline"],
-            "scenicScore": result.get("scenic_scores", {}).get(r["id"], 0),
+            "scenicScore": scores.get(r["id"], 0),
         }
         for r in result.get("routes", [])
     ]
-    top = max(routes, key=lambda x: x["scenicScore"], default=None)
-    return {
+    response = {
         "routes": routes,
-        "scores": result.get("scenic_scores", {}),
+        "scores": scores,
         "explanation": result.get("explanation", ""),
-        "topScenicRouteId": top["id"] if top else None,
+        "topScenicRouteId": result.get("top_route_id"),
         "timestamp": int(time.time()),
     }
+    if include_pois:
+        response["poisByRoute"] = result.get("places_by_route", {})
+    return response
+
+@app.post("/scenic")
+async def scenic_trip(req: ScenicRequest):
+    result = await app_graph.ainvoke({"origin": req.origin, "destination": req.destination})
+    return scenic_response(result, req.includePois)
+
+@app.post("/scenic/stream")
+async def scenic_trip_stream(req: ScenicRequest):
+    """NDJSON: first line is the /scenic payload (empty explanation), then {"text": ...} chunks.
+
+    If the explanation is cut off, the last line is {"error": ..., "fallback": ...} instead.
+    """
+    result = await scout_graph.ainvoke({"origin": req.origin, "destination": req.destination})
+    prepared = explain_prompt(result)
+
+    async def events():
+        yield orjson.dumps(scenic_response(result, req.includePois)) + b"\n"
+        try:
+            async for text in stream_explanation(prepared):
+                yield orjson.dumps({"text": text}) + b"\n"
+        except Exception:
+            yield orjson.dumps({"error": "explanation stream interrupted", "fallback": prepared[1]}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
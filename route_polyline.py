@@ -0,0 +1,137 @@
+"""Polyline decoding for the Streamlit tester.
+
+Kept out of streamlit_app.py because Streamlit re-executes the script on
+every interaction: definitions here (the decode cache, the JIT-compiled
+decoder) are created once per process instead of once per rerun.
+"""
+import functools
+
+import numpy as np
+
+try:
+    from pypolyline.util import decode_polyline
+except ImportError:
+    try:
+        from pypolyline.cutil import decode_polyline
+    except ImportError:
+        decode_polyline = None
+
+# Optional JIT path, only loaded when there is no compiled pypolyline to use:
+# `pip install numba` on CPython-only deployments.
+numba = None
+if decode_polyline is None:
+    try:
+        import numba
+    except ImportError:
+        pass
+
+
+def _fast_decode(s, precision=5):
+    """Pure-Python polyline decoder: one linear pass with a single index cursor."""
+    factor = 10.0 ** precision
+    n = len(s)
+    pts = []
+    i = lat = lon = 0
+    while i < n:
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                b = ord(s[i]) - 63
+                i += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        pts.append((lat / factor, lon / factor))
+    return pts
+
+
+def _decode_bytes(buf, precision):
+    """Decode a polyline's bytes into an (N, 2) lat/lon array; numba-compilable.
+
+    Raises ValueError if the input ends inside a value, like _fast_decode's
+    IndexError, so a truncated polyline never yields a made-up pair.
+    """
+    n = buf.shape[0]
+    # every coordinate pair takes at least two bytes
+    out = np.empty((n // 2 + 1, 2), np.float64)
+    factor = 10.0 ** precision
+    i = 0
+    k = 0
+    lat = 0
+    lon = 0
+    while i < n:
+        for axis in range(2):
+            result = 0
+            shift = 0
+            terminated = False
+            while i < n:
+                b = np.int64(buf[i]) - 63
+                i += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    terminated = True
+                    break
+            if not terminated:
+                raise ValueError("truncated polyline")
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lon += delta
+        out[k, 0] = lat / factor
+        out[k, 1] = lon / factor
+        k += 1
+    return out[:k]
+
+
+if numba is not None:
+    decode_polyline_nb = numba.njit(cache=True)(_decode_bytes)
+    # Compile (or load from the on-disk cache) now, not on the first request.
+    decode_polyline_nb(np.frombuffer(b"_p~iF~ps|U", np.uint8), 5)
+else:
+    decode_polyline_nb = None
+
+
+def _check_complete(buf):
+    """Raise ValueError unless `buf` holds only whole (lat, lon) value pairs.
+
+    Each value ends in exactly one byte below 95 (chunk without the 0x20
+    continuation bit), so a complete polyline ends in one and has an even
+    number of them. pypolyline silently decodes input that stops inside a
+    longitude, so this runs before every backend to keep them in agreement.
+    """
+    if not buf.size:
+        return
+    if buf.min() < 63 or buf.max() > 126:
+        raise ValueError("invalid polyline character")
+    ends = buf < 95
+    if not ends[-1] or ends.sum() % 2:
+        raise ValueError("truncated polyline")
+
+
+@functools.lru_cache(maxsize=256)
+def decode_points(encoded):
+    """Decode a Google encoded polyline into a read-only (N, 2) array of lat/lon, memoized per string.
+
+    Malformed or truncated input gives an empty (0, 2) array whichever decoder is installed.
+    """
+    try:
+        buf = np.frombuffer(encoded.encode(), np.uint8)
+        _check_complete(buf)
+        if decode_polyline is not None:
+            # pypolyline returns [lon, lat] pairs
+            pts = np.asarray(decode_polyline(buf.tobytes(), 5), dtype=np.float64).reshape(-1, 2)[:, ::-1]
+        elif decode_polyline_nb is not None:
+            pts = decode_polyline_nb(buf, 5)
+        else:
+            pts = np.asarray(_fast_decode(encoded, 5), dtype=np.float64).reshape(-1, 2)
+    except Exception:
+        pts = np.empty((0, 2))
+    pts.flags.writeable = False
+    return pts
@@ -1,11 +1,13 @@
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 import pydeck as pdk
-import polyline as poly
+from route_polyline import decode_points
 
 API_URL = os.getenv("SCENIC_API_URL", "http://127.0.0.1:8000/scenic")
+STREAM_URL = API_URL.rstrip("/") + "/stream"
 
 st.set_page_config(page_title="Tripster Scenic Tester", layout="wide")
 st.title("Tripster Scenic Route Tester")
@@ -19,44 +21,78 @@ with st.sidebar:
         ["balanced", "nature", "water", "desert", "city"],
         index=0,
     )
+    stream_explanation = st.checkbox("Stream explanation", value=True)
     go = st.button("Plan Scenic Trip")
 
 
-def route_to_path_features(route, color):
-    try:
-        pts = poly.decode(route.get("polyline", ""))
-    except Exception:
-        pts = []
-    if not pts:
+@st.cache_resource
+def get_session():
+    """Keep-alive session shared across reruns so the API connection is reused."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def route_to_path_features(route_id, pts, color):
+    if not len(pts):
         return []
     return [
         {
-            "path": [[lon, lat] for lat, lon in pts],
+            "path": pts[:, [1, 0]].tolist(),
             "color": color,
-            "id": route.get("id", "route"),
+            "id": route_id,
         }
     ]
 
 
-def center_from_routes(routes):
-    for r in routes:
-        try:
-            pts = poly.decode(r.get("polyline", ""))
-            if pts:
-                lat, lon = pts[len(pts) // 2]
-                return lat, lon
-        except Exception:
-            continue
+@st.cache_resource(max_entries=256)
+def build_layer(route_id, encoded, color, width_min_pixels, _pts):
+    """PathLayer for one route, reused across reruns; None if the polyline is empty.
+
+    Cached on the encoded polyline; the already-decoded `_pts` is left out of
+    the cache key (leading underscore) so Streamlit does not hash the array.
+    """
+    features = route_to_path_features(route_id, _pts, list(color))
+    if not features:
+        return None
+    return pdk.Layer(
+        "PathLayer",
+        data=features,
+        get_path="path",
+        get_color="color",
+        width_scale=1,
+        width_min_pixels=width_min_pixels,
+        pickable=True,
+    )
+
+
+@st.cache_data
+def center_from_routes(encoded_polylines, _decoded):
+    """Map center from the middle of the first non-empty route, keyed on the polylines."""
+    for pts in _decoded.values():
+        if len(pts):
+            lat, lon = pts[len(pts) // 2]
+            return float(lat), float(lon)
     return 34.85, -111.76
 
 
 if go:
     with st.spinner("Calling Scenic API..."):
         try:
-            payload = {"origin": origin, "destination": destination, "scenicMode": scenic_mode}
-            r = requests.post(API_URL, json=payload, timeout=60)
-            r.raise_for_status()
-            data = r.json()
+            payload = {"origin": origin, "destination": destination, "scenicMode": scenic_mode, "includePois": True}
+            if stream_explanation:
+                # NDJSON: route payload first, then explanation text chunks
+                r = get_session().post(STREAM_URL, json=payload, timeout=60, stream=True)
+                r.raise_for_status()
+                lines = r.iter_lines()
+                data = json.loads(next(lines))
+            else:
+                r = get_session().post(API_URL, json=payload, timeout=60)
+                r.raise_for_status()
+                data = r.json()
+                lines = None
         except Exception as e:
             st.error(f"API call failed: {e}")
             st.stop()
@@ -69,7 +105,9 @@ if go:
         st.subheader("Top Scenic Route")
         st.write(data.get("topScenicRouteId"))
         st.subheader("Explanation")
-        st.write(data.get("explanation", ""))
+        explanation_slot = st.empty()
+        if lines is None:
+            explanation_slot.write(data.get("explanation", ""))
         st.subheader("POIs (first route)")
         pois_by_route = data.get("poisByRoute", {})
         routes = data.get("routes", [])
@@ -89,24 +127,47 @@ if go:
             [220, 20, 60, 200],
             [0, 206, 209, 200],
         ]
+        # Decode each polyline once; the layers and the map center share it.
+        # Both are cached on the encoded polylines, so reruns from unrelated
+        # widgets reuse them without rebuilding anything.
+        decoded = {route.get("id", "route"): decode_points(route.get("polyline", "")) for route in routes}
         layers = []
         for idx, route in enumerate(routes):
             col = color_map.get(route.get("id"), fallback_colors[idx % len(fallback_colors)])
-            features = route_to_path_features(route, col)
-            if features:
-                layers.append(
-                    pdk.Layer(
-                        "PathLayer",
-                        data=features,
-                        get_path="path",
-                        get_color="color",
-                        width_scale=1,
-                        width_min_pixels=5 if route.get("id") == data.get("topScenicRouteId") else 3,
-                        pickable=True,
-                    )
-                )
-
-        lat, lon = center_from_routes(routes)
+            route_id = route.get("id", "route")
+            layer = build_layer(
+                route_id,
+                route.get("polyline", ""),
+                tuple(col),
+                5 if route_id == data.get("topScenicRouteId") else 3,
+                decoded[route_id],
+            )
+            if layer is not None:
+                layers.append(layer)
+
+        lat, lon = center_from_routes(tuple(route.get("polyline", "") for route in routes), decoded)
         view_state = pdk.ViewState(latitude=lat, longitude=lon, zoom=8)
         st.pydeck_chart(pdk.Deck(layers=layers, initial_view_state=view_state, tooltip={"text": "{id}"}))
 
+    if lines is not None:
+        interrupted = {}
+
+        def explanation_chunks():
+            for line in lines:
+                if not line:
+                    continue
+                event = json.loads(line)
+                # the server ends a cut-off stream with {"error": ..., "fallback": ...}
+                if "error" in event:
+                    interrupted.update(event)
+                    return
+                yield event["text"]
+
+        with explanation_slot.container():
+            try:
+                st.write_stream(explanation_chunks())
+            except Exception as e:
+                st.error(f"Explanation stream failed: {e}")
+            if interrupted:
+                st.error(f"Explanation was cut off: {interrupted['error']}")
+                st.write(interrupted.get("fallback", ""))
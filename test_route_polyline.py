@@ -0,0 +1,103 @@
+"""Check that the polyline decoders in route_polyline agree with each other."""
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+import route_polyline  # noqa: E402
+
+# Example from Google's "Encoded Polyline Algorithm Format" documentation.
+GOOGLE_REFERENCE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def _as_points(decode):
+    # Mirror decode_points: completeness check first, any error -> empty array.
+    def run(encoded):
+        try:
+            route_polyline._check_complete(np.frombuffer(encoded.encode(), np.uint8))
+            pts = decode(encoded)
+        except Exception:
+            pts = []
+        return np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    return run
+
+
+def _decoders():
+    decoders = {
+        "fast": _as_points(lambda s: route_polyline._fast_decode(s, 5)),
+        "bytes": _as_points(
+            lambda s: route_polyline._decode_bytes(np.frombuffer(s.encode(), np.uint8), 5)
+        ),
+    }
+    try:
+        import numba
+    except ImportError:
+        pass
+    else:
+        nb = numba.njit(route_polyline._decode_bytes)
+        decoders["numba"] = _as_points(lambda s: nb(np.frombuffer(s.encode(), np.uint8), 5))
+    if route_polyline.decode_polyline is not None:
+        # pypolyline returns [lon, lat] pairs
+        decoders["pypolyline"] = _as_points(
+            lambda s: [(lat, lon) for lon, lat in route_polyline.decode_polyline(s.encode(), 5)]
+        )
+    return decoders
+
+
+DECODERS = _decoders()
+
+
+def _assert_agree(encoded):
+    results = {name: decode(encoded) for name, decode in DECODERS.items()}
+    expected = results["fast"]
+    for name, pts in results.items():
+        assert pts.shape == expected.shape, (name, encoded)
+        assert np.allclose(pts, expected, atol=1e-9), (name, encoded)
+
+
+@pytest.mark.parametrize("name", sorted(DECODERS))
+def test_google_reference(name):
+    pts = DECODERS[name](GOOGLE_REFERENCE)
+    assert np.allclose(pts, GOOGLE_POINTS, atol=1e-9)
+
+
+def test_random_round_trips():
+    polyline = pytest.importorskip("polyline")
+    rng = random.Random(0)
+    for _ in range(200):
+        points = [
+            (round(rng.uniform(-90, 90), 5), round(rng.uniform(-180, 180), 5))
+            for _ in range(rng.randint(1, 50))
+        ]
+        encoded = polyline.encode(points, 5)
+        for pts in (decode(encoded) for decode in DECODERS.values()):
+            assert np.allclose(pts, points, atol=1e-9)
+
+
+@pytest.mark.parametrize("encoded", ["", "_p~iF", "garbage?", GOOGLE_REFERENCE[:-1]])
+def test_truncated_input_yields_no_points(encoded):
+    for name, decode in DECODERS.items():
+        assert decode(encoded).shape == (0, 2), name
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF", "garbage?", GOOGLE_REFERENCE[:-1]])
+def test_strict_decoders_reject_truncated_input(encoded):
+    with pytest.raises(ValueError):
+        route_polyline._decode_bytes(np.frombuffer(encoded.encode(), np.uint8), 5)
+    with pytest.raises(IndexError):
+        route_polyline._fast_decode(encoded, 5)
+
+
+def test_all_prefixes_agree():
+    for end in range(len(GOOGLE_REFERENCE) + 1):
+        _assert_agree(GOOGLE_REFERENCE[:end])
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF", "_p~iF~ps", "garbage?", "_p~iF~ps|U!"])
+def test_decode_points_rejects_bad_input(encoded):
+    assert route_polyline.decode_points(encoded).shape == (0, 2)
+
+
+def test_decode_points_reference():
+    assert np.allclose(route_polyline.decode_points(GOOGLE_REFERENCE), GOOGLE_POINTS, atol=1e-9)